@@ -0,0 +1,44 @@
+"""Compiled kernels for evaluating peak shapes on the energy grid.
+They are JIT-compiled with numba (see requirements.txt). If numba cannot
+be imported, the same functions run as plain numpy code.
+"""
+# pylint: disable=invalid-name
+# pylint: disable=too-many-arguments
+
+import numpy as np
+
+from gxps.models import s2pi, s2ln2, tiny
+
+try:
+    from numba import njit
+    jit = njit(fastmath=True, cache=True)
+except ImportError:
+    def jit(func):
+        """Fallback decorator doing nothing when numba is missing."""
+        return func
+
+
+@jit
+def pseudovoigt_accumulate(x, center, fwhm, amplitude, fraction, out):
+    """Adds gxps.models.gl_sum evaluated at x to out in place. Takes only
+    scalar parameters and one-dimensional arrays of equal length.
+    """
+    sigma = max(tiny, fwhm / (2 * s2ln2))
+    gamma = max(tiny, fwhm / 2)
+    gnorm = (1 - fraction) * amplitude / (s2pi * sigma)
+    lnorm = fraction * amplitude * gamma / np.pi
+    arg = center - x
+    out += (
+        gnorm * np.exp(-arg**2 / (2 * sigma**2))
+        + lnorm / (arg**2 + gamma**2)
+    )
+
+
+@jit
+def pseudovoigt(x, center, fwhm, amplitude, fraction):
+    """Same as gxps.models.gl_sum, but takes only scalar parameters and
+    a one-dimensional energy array x.
+    """
+    out = np.zeros(x.shape)
+    pseudovoigt_accumulate(x, center, fwhm, amplitude, fraction, out)
+    return out
@@ -400,8 +400,9 @@ class Fit(Operator):
         def add_region(emin, emax):
             """Add region"""
             for spectrum in self.state.active_spectra:
-                spectrum.background_type = "shirley"
-                spectrum.add_background_bounds(emin, emax)
+                with spectrum.batch_background():
+                    spectrum.background_type = "shirley"
+                    spectrum.add_background_bounds(emin, emax)
             self.bus.fire()
         spanprops = {"edgecolor": COLORS["Plotting"]["region-vlines"], "lw": 2}
         navbar.get_span(add_region, **spanprops)
@@ -414,13 +415,14 @@ class Fit(Operator):
         new_value = event.properties["value"][0]
         spectrum = event.properties["data"][0]
         bg_bounds = spectrum.background_bounds.copy()
-        for lower, upper in zip(bg_bounds[0::2], bg_bounds[1::2]):
-            if old_value == lower:
-                spectrum.remove_background_bounds(lower, upper)
-                spectrum.add_background_bounds(new_value, upper)
-            if old_value == upper:
-                spectrum.remove_background_bounds(lower, upper)
-                spectrum.add_background_bounds(lower, new_value)
+        with spectrum.batch_background():
+            for lower, upper in zip(bg_bounds[0::2], bg_bounds[1::2]):
+                if old_value == lower:
+                    spectrum.remove_background_bounds(lower, upper)
+                    spectrum.add_background_bounds(new_value, upper)
+                if old_value == upper:
+                    spectrum.remove_background_bounds(lower, upper)
+                    spectrum.add_background_bounds(lower, new_value)
         self.bus.fire()
 
     def on_remove_region(self, *_args):
@@ -434,11 +436,12 @@ class Fit(Operator):
             esel = x_1
             for spectrum in self.state.active_spectra:
                 bg_bounds = spectrum.background_bounds.copy()
-                for lower, upper in zip(bg_bounds[0::2], bg_bounds[1::2]):
-                    if esel >= lower and esel <= upper:
-                        spectrum.remove_background_bounds(lower, upper)
-                if not any(spectrum.background_bounds):
-                    spectrum.background_type = "none"
+                with spectrum.batch_background():
+                    for lower, upper in zip(bg_bounds[0::2], bg_bounds[1::2]):
+                        if esel >= lower and esel <= upper:
+                            spectrum.remove_background_bounds(lower, upper)
+                    if not any(spectrum.background_bounds):
+                        spectrum.background_type = "none"
             self.bus.fire()
         navbar.get_point(remove_region)
 
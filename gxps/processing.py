@@ -136,10 +136,7 @@ def calculate_normalization_divisor(norm_type, norm_div, _energy, intensity):
 def is_equidistant(energy, tol=1e-08):
     """Returns True only when energy is equidistant."""
     spacings = np.unique(np.diff(energy))
-    for spacing in spacings[1:]:
-        if not np.isclose(spacing, spacings[0], atol=tol):
-            return False
-    return True
+    return np.allclose(spacings[1:], spacings[:1], atol=tol)
 
 def make_increasing(energy, intensity):
     """Makes energy increasing and sorts intensity accordingly."""
@@ -152,9 +149,8 @@ def make_equidistant(energy, intensity):
     """Makes x, y pair so that x is equidistant."""
     spacings = np.unique(np.diff(energy))
     # try to eliminate spacings that are too small
-    while np.isclose(0, spacings.min()):
-        spacings.remove(spacings.min())
-    if all([np.isclose(spacing, spacings[0]) for spacing in spacings]):
+    spacings = spacings[~np.isclose(0, spacings)]
+    if np.allclose(spacings, spacings[:1]):
         return energy, intensity
     samples = int((energy.max() - energy.min()) / spacings.min())
     spaced_energy = np.linspace(energy.min(), energy.max(), samples)
@@ -1,15 +1,17 @@
 """Spectrum class represents spectrum data."""
 # pylint: disable=too-many-instance-attributes
-# pylint: disable=logging-format-interpolation
 # pylint: disable=invalid-name
 
 import logging
 import re
+from contextlib import contextmanager
 
 import numpy as np
+from scipy.optimize import least_squares
 from lmfit import Parameters
 from lmfit.models import ConstantModel#, PseudoVoigtModel
 
+from gxps import _kernels
 from gxps.utility import Observable, MetaDataContainer
 from gxps.processing import (
     IgnoreUnderflow,
@@ -30,6 +32,9 @@ from gxps.models import(
 
 LOG = logging.getLogger(__name__)
 
+NAME_RE = re.compile(r"\b[A-Za-z][A-Za-z0-9]*")
+NAME_PARAM_RE = re.compile(r"\b[A-Za-z][A-Za-z0-9]*_[a-z_]+")
+
 
 class SpectrumContainer(Observable):
     """
@@ -39,8 +44,9 @@ class SpectrumContainer(Observable):
 
     def __init__(self, *args, **kwargs):
         self._spectra = []
+        self._spectra_tuple = ()
         super().__init__(*args, **kwargs)
-        LOG.info("{} created".format(self))
+        LOG.info("%s created", self)
 
     @property
     def children(self):
@@ -49,29 +55,34 @@ class SpectrumContainer(Observable):
 
     @property
     def spectra(self):
-        """Returns spectrum objects."""
-        return self._spectra.copy()
+        """Returns spectrum objects as a tuple that is only rebuilt when
+        spectra are added or removed.
+        """
+        return self._spectra_tuple
 
     def add_spectrum(self, spectrum=None, **specdict):
         """Adds a spectrum."""
         if not spectrum:
             spectrum = ModeledSpectrum(**specdict)
         self._spectra.append(spectrum)
+        self._spectra_tuple = tuple(self._spectra)
 
-        LOG.info("Added spectrum {} to {}".format(spectrum, self))
+        LOG.info("Added spectrum %s to %s", spectrum, self)
         self.emit("changed-spectra")
         return spectrum
 
     def remove_spectrum(self, spectrum):
         """Removes a spectrum."""
-        LOG.info("Removing spectrum {} from {}".format(spectrum, self))
+        LOG.info("Removing spectrum %s from %s", spectrum, self)
         self._spectra.remove(spectrum)
+        self._spectra_tuple = tuple(self._spectra)
         self.emit("changed-spectra")
 
     def clear(self):
         """Clear all spectra from self."""
         self._spectra.clear()
-        LOG.info("Cleared container {}".format(self))
+        self._spectra_tuple = ()
+        LOG.info("Cleared container %s", self)
         self.emit("changed-spectra")
 
 
@@ -83,6 +94,10 @@ class Spectrum(Observable, MetaDataContainer):
     _required = ("energy", "intensity", "name", "filename", "notes")
     bg_types = ("none", "linear", "shirley", "tougaard")
     norm_types = ("none", "highest", "high_energy", "low_energy", "manual")
+    # fallbacks for objects unpickled from project files of older versions
+    _energy_cache = None
+    _bg_batch_depth = 0
+    _bg_dirty = None
 
     def __init__(self, **kwargs):
         if not all(a in kwargs for a in self._required):
@@ -92,21 +107,24 @@ class Spectrum(Observable, MetaDataContainer):
 
         self._photon_energy = kwargs.pop("photon_energy", 0)
 
-        energy = np.array(kwargs.pop("energy"))
+        energy = np.ascontiguousarray(kwargs.pop("energy"), dtype=float)
         energy_scale = kwargs.pop("energy_scale", "binding")
         if energy_scale == "kinetic":
             energy = self.photon_energy - energy
-        intensity = np.array(kwargs.pop("intensity"))
+        intensity = np.ascontiguousarray(kwargs.pop("intensity"), dtype=float)
         if len(energy) != len(intensity) or energy.ndim != 1:
             raise ValueError("energy and intensity array sizes differ")
         energy, intensity = make_increasing(energy, intensity)
         energy, intensity = make_equidistant(energy, intensity)
         self._energy = energy
+        self._energy_cache = None
         self._intensity = intensity
 
         self._background = np.zeros(self._energy.shape)
         self._background_type = "none"
         self._background_bounds = np.array([])
+        self._bg_batch_depth = 0
+        self._bg_dirty = None
 
         self._energy_calibration = 0
         self._normalization_type = "none"
@@ -116,11 +134,19 @@ class Spectrum(Observable, MetaDataContainer):
         for key, value in kwargs.items():
             self.set_meta(key, value, silent=True)
 
-        LOG.info("Spectrum '{}' created ({})".format(self.name, self))
+        LOG.info("Spectrum '%s' created (%s)", self.name, self)
+
+    def __getstate__(self):
+        """Leave the cached arrays out of pickled project files and
+        copies.
+        """
+        state = self.__dict__.copy()
+        state["_energy_cache"] = None
+        return state
 
     def _set_meta(self, attr, value):
         """Ensure that setting meta data creates an event."""
-        LOG.info("'{}' changes '{}' to '{}'".format(self, attr, value))
+        LOG.info("'%s' changes '%s' to '%s'", self, attr, value)
         self.emit("changed-spectrum-meta", attr=attr, value=value)
 
     @property
@@ -136,8 +162,15 @@ class Spectrum(Observable, MetaDataContainer):
     # Energy-related
     @property
     def energy(self):
-        """Energy numpy array."""
-        return self._energy + self._energy_calibration
+        """Energy numpy array. It is cached until the calibration or the
+        photon energy change, so treat it as read-only.
+        """
+        if self._energy_cache is None:
+            if self._energy_calibration:
+                self._energy_cache = self._energy + self._energy_calibration
+            else:
+                self._energy_cache = self._energy
+        return self._energy_cache
 
     @property
     def kinetic_energy(self):
@@ -155,6 +188,7 @@ class Spectrum(Observable, MetaDataContainer):
         diff = value - self._photon_energy
         self._photon_energy = value
         self._energy = self._energy + diff
+        self._energy_cache = None
         self.emit("changed-spectrum", attr="photon_energy")
 
     @property
@@ -168,13 +202,18 @@ class Spectrum(Observable, MetaDataContainer):
         if abs(value) == np.inf:
             raise ValueError("Invalid energy calibration value 'np.inf'.")
         self._energy_calibration = value
-        LOG.info("'{}' changed energy cal to '{}'".format(self, value))
+        self._energy_cache = None
+        LOG.info("'%s' changed energy cal to '%s'", self, value)
         self.emit("changed-spectrum", attr="energy_calibration")
 
     # Intensity-related
     @property
     def intensity(self):
-        """Intensity numpy array."""
+        """Intensity numpy array. Without normalization, this is the stored
+        array itself, so treat it as read-only.
+        """
+        if self._normalization_divisor == 1.0:
+            return self._intensity
         return self._intensity / self._normalization_divisor
 
     def intensity_of_E(self, energy):
@@ -201,7 +240,7 @@ class Spectrum(Observable, MetaDataContainer):
                 self.energy,
                 self._intensity
             )
-        LOG.info("'{}' changed norm type to '{}'".format(self, value))
+        LOG.info("'%s' changed norm type to '%s'", self, value)
         self.emit("changed-spectrum", attr="normalization_type")
 
     @property
@@ -216,7 +255,7 @@ class Spectrum(Observable, MetaDataContainer):
             raise ValueError("Invalid normalization divisor '0.0'")
         self._normalization_type = "manual"
         self._normalization_divisor = value
-        LOG.info("'{}' changed norm divisor to '{}'".format(self, value))
+        LOG.info("'%s' changed norm divisor to '%s'", self, value)
         self.emit("changed-spectrum", attr="normalization_divisor")
 
     @property
@@ -237,7 +276,11 @@ class Spectrum(Observable, MetaDataContainer):
     # Background-related
     @property
     def background(self):
-        """Background numpy array."""
+        """Background numpy array. Without normalization, this is the stored
+        array itself, so treat it as read-only.
+        """
+        if self._normalization_divisor == 1.0:
+            return self._background
         return self._background / self._normalization_divisor
 
     def background_of_E(self, energy):
@@ -257,14 +300,8 @@ class Spectrum(Observable, MetaDataContainer):
         if self._background_type == value:
             return
         self._background_type = value
-        self._background = calculate_background(
-            self.background_type,
-            self._background_bounds,
-            self._energy,
-            self._intensity
-        )
-        LOG.info("'{}' changed bg type to '{}'".format(self, value))
-        self.emit("changed-spectrum", attr="background_type")
+        LOG.info("'%s' changed bg type to '%s'", self, value)
+        self._background_changed("background_type")
 
     @property
     def background_bounds(self):
@@ -277,23 +314,58 @@ class Spectrum(Observable, MetaDataContainer):
     @background_bounds.setter
     def background_bounds(self, value):
         """Only even-length numeral sequence-types are valid."""
-        if len(value) % 2 != 0:
+        bounds = np.asarray(value, dtype=float)
+        if bounds.ndim != 1:
+            raise ValueError("Background bounds must be a flat sequence.")
+        if bounds.size % 2 != 0:
             raise ValueError("Background bounds must be pairwise.")
-        if not any(value):
-            self._background_bounds = np.array([])
-        for bound in value:
-            if bound > self.energy.max() or bound < self.energy.min():
-                raise ValueError("Background bound out of energy range.")
-        self._background_bounds = np.array(sorted(list(value)))
-        self._background_bounds -= self._energy_calibration
+        energy = self.energy
+        if bounds.size and (
+                bounds.max() > energy.max() or bounds.min() < energy.min()):
+            raise ValueError("Background bound out of energy range.")
+        self._background_bounds = np.sort(bounds) - self._energy_calibration
+        LOG.info("'%s' changed bg bounds to '%s'", self, value)
+        self._background_changed("background_bounds")
+
+    @contextmanager
+    def batch_background(self):
+        """Context manager deferring the background recalculation and the
+        "changed-spectrum" signal of the background setters until the
+        outermost batch_background block is left.
+        """
+        self._bg_batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._bg_batch_depth -= 1
+            if self._bg_batch_depth == 0 and self._bg_dirty is not None:
+                attr = self._bg_dirty
+                self._bg_dirty = None
+                self._background_changed(attr)
+
+    def _background_changed(self, attr):
+        """Recalculates the background and emits a signal for attr, or
+        marks the background as dirty inside batch_background.
+        """
+        if self._bg_batch_depth:
+            self._bg_dirty = attr
+            return
+        self._recompute_background()
+        self.emit("changed-spectrum", attr=attr)
+
+    def _recompute_background(self):
+        """Recalculates the background from the uncalibrated energy and
+        bounds. Type "none" needs no calculation.
+        """
+        if self._background_type == "none":
+            self._background = np.zeros(self._energy.shape)
+            return
         self._background = calculate_background(
-            self.background_type,
-            self.background_bounds,
-            self.energy,
+            self._background_type,
+            self._background_bounds,
+            self._energy,
             self._intensity
         )
-        LOG.info("'{}' changed bg bounds to '{}'".format(self, value))
-        self.emit("changed-spectrum", attr="background_bounds")
 
     def add_background_bounds(self, emin, emax):
         """Adds one pair of background boundaries."""
@@ -306,8 +378,12 @@ class Spectrum(Observable, MetaDataContainer):
         """Removes one pair of background boundaries."""
         if emin > emax:
             emin, emax = emax, emin
-        old_bounds = self.background_bounds.copy()
-        self.background_bounds = np.setdiff1d(old_bounds, [emin, emax])
+        bounds = self.background_bounds.tolist()
+        if emin not in bounds or emax not in bounds:
+            raise ValueError("Background bounds not found.")
+        bounds.remove(emin)
+        bounds.remove(emax)
+        self.background_bounds = bounds
 
 
 class ModeledSpectrum(Spectrum):
@@ -317,12 +393,27 @@ class ModeledSpectrum(Spectrum):
     _required = ("energy", "intensity", "name", "filename", "notes")
     bg_types = ("none", "linear", "shirley", "tougaard")
     norm_types = ("none", "manual", "highest", "high_energy", "low_energy")
+    # fallbacks for objects unpickled from project files of older versions
+    _fit_cache = (None, None)
 
     def __init__(self, *args, **kwargs):
         self.params = Parameters()
         self._peaks = []
+        self._fit_cache = (None, None)
         super().__init__(*args, **kwargs)
 
+    def __getstate__(self):
+        """Leave the cached fit out of pickled project files and copies."""
+        state = super().__getstate__()
+        state["_fit_cache"] = (None, None)
+        return state
+
+    def emit(self, signal, **kwargs):
+        """Drop the cached fit before notifying observers."""
+        if signal == "changed-fit":
+            self._fit_cache = (None, None)
+        super().emit(signal, **kwargs)
+
     @property
     def children(self):
         """Observable children objects."""
@@ -335,21 +426,35 @@ class ModeledSpectrum(Spectrum):
 
     @property
     def fit(self):
-        """Returns fit result on whole energy range."""
-        with IgnoreUnderflow():
-            fit = self.model.eval(params=self.params, x=self.energy)
-        try:
-            if len(fit) != len(self.energy):
-                LOG.warning("Fit array has different length as energy array.")
-        except TypeError:
-            fit = np.zeros(self.energy.shape)
+        """Returns fit result on whole energy range. The result is cached
+        as long as neither the parameters nor the energy array change, so
+        treat it as read-only.
+        """
+        energy = self.energy
+        key = (
+            tuple(self.params.valuesdict().items()),
+            id(energy),
+            energy.shape[0]
+        )
+        cached_key, cached = self._fit_cache
+        if key == cached_key and cached[0] is energy:
+            return cached[1]
+        fit = self.evaluate(energy)
+        self._fit_cache = (key, (energy, fit))
         return fit
 
     def fit_of_E(self, energy):
         """Returns model intensity at given energy."""
-        energy = np.array([energy])
-        with IgnoreUnderflow():
-            fit = self.model.eval(params=self.params, x=energy)
+        return self.evaluate(np.array([energy]))
+
+    def evaluate(self, energy):
+        """Sums up all peak intensities at the energies in the given
+        array into one preallocated array.
+        """
+        energy = np.asarray(energy, dtype=float)
+        fit = np.zeros(energy.shape)
+        for peak in self._peaks:
+            peak.accumulate_intensity(energy, fit)
         return fit
 
     @property
@@ -359,10 +464,13 @@ class ModeledSpectrum(Spectrum):
 
     @property
     def model(self):
-        """Returns the sum of all peak models."""
+        """Returns the sum of all peak models. Only needed for fitting,
+        use self.evaluate() for calculating the model intensity.
+        """
         model = ConstantModel(prefix="BASE_")
         model.set_param_hint("c", vary=False, value=0)
-        self.params += model.make_params()
+        for param in model.make_params().values():
+            self.params[param.name] = param
 
         for peak in self._peaks:
             model += peak.model
@@ -370,16 +478,58 @@ class ModeledSpectrum(Spectrum):
 
     def do_fit(self):
         """Returns the fitted cps values."""
+        energy = self.energy
+        intensity = self.intensity - self.background
         with IgnoreUnderflow():
-            result = self.model.fit(
-                self.intensity - self.background,
-                self.params,
-                x=self.energy
-            )
-        self.params.update(result.params)
-        LOG.info("'{}' fitted".format(self))
+            if not self._fit_fast(energy, intensity):
+                result = self.model.fit(intensity, self.params, x=energy)
+                self.params.update(result.params)
+        LOG.info("'%s' fitted", self)
         self.emit("changed-fit")
 
+    def _fit_fast(self, energy, intensity):
+        """Fits the peaks with scipy's least_squares, evaluating the model
+        with the compiled PseudoVoigt kernel into one reused array.
+        Returns False without fitting if any peak has another shape or
+        any parameter is constrained, so that lmfit has to do the fit.
+        """
+        # pylint: disable=protected-access
+        if any(peak._name_params is None for peak in self._peaks):
+            return False
+        params = [
+            self.params[name]
+            for peak in self._peaks for name in peak._name_params
+        ]
+        if any(param.expr for param in params):
+            return False
+        varied = [i for i, param in enumerate(params) if param.vary]
+        lower = np.array([params[i].min for i in varied], dtype=float)
+        upper = np.array([params[i].max for i in varied], dtype=float)
+        if not varied or np.any(lower >= upper):
+            return False
+
+        values = np.array([param.value for param in params], dtype=float)
+        model = np.empty(energy.shape)
+        def residual(varied_values):
+            """Model minus data for the given varied parameter values."""
+            values[varied] = varied_values
+            model[:] = 0
+            for center, fwhm, amplitude, fraction in values.reshape(-1, 4):
+                _kernels.pseudovoigt_accumulate(
+                    energy, center, fwhm, amplitude, fraction, model
+                )
+            return model - intensity
+
+        result = least_squares(
+            residual,
+            np.clip(values[varied], lower, upper),
+            bounds=(lower, upper),
+            method="trf"
+        )
+        for i, value in zip(varied, result.x):
+            params[i].value = value
+        return True
+
     def add_peak(self, name, **kwargs):
         """
         Add a peak with given parameters. Valid parameters:
@@ -461,6 +611,9 @@ class Peak(Observable):
         "expr": ""
     }
     shapes = ["PseudoVoigt", "DoniachSunjic", "Voigt"]
+    # fallbacks for objects unpickled from project files of older versions
+    _name_params = None
+    _cache = (None, None)
 
     def __init__(
             self, name, spectrum,
@@ -478,13 +631,17 @@ class Peak(Observable):
             raise ValueError("Required attribute(s) missing")
 
         self._model = None
+        self._name_params = None
+        self._cache = (None, None)
         self.initialize_model(area, fwhm, position, alpha, beta, gamma)
-        LOG.info("Peak '{}' created ({})".format(self.name, self))
+        LOG.info("Peak '%s' created (%s)", self.name, self)
 
     def initialize_model(self, area, fwhm, position, alpha, beta, gamma):
         """Initialize the peak model and the parameters."""
         # pylint: disable=too-many-arguments, unused-argument
         self.clear_params()
+        self._name_params = None
+        self._cache = (None, None)
         self.param_aliases = {
             "area": "amplitude",
             "fwhm": "fwhm",
@@ -496,6 +653,10 @@ class Peak(Observable):
                 alpha = 0.5
             self._model = PseudoVoigtModel(prefix="{}_".format(self.name))
             self._model.set_param_hint("fraction", min=0, value=alpha)
+            self._name_params = tuple(
+                "{}_{}".format(self.name, param_name)
+                for param_name in ("center", "fwhm", "amplitude", "fraction")
+            )
         elif self._shape == "DoniachSunjic":
             self.param_aliases["alpha"] = "asym"
             if alpha is None:
@@ -511,7 +672,8 @@ class Peak(Observable):
         else:
             raise NotImplementedError("Unkown shape '{}'".format(self._shape))
 
-        self.params += self._model.make_params()
+        for param in self._model.make_params().values():
+            self.params[param.name] = param
         self.get_param("fwhm").set(value=fwhm, min=0, vary=True)
         self.get_param("amplitude").set(value=area, min=0, vary=True)
         self.get_param("center").set(value=position, min=-np.inf, vary=True)
@@ -539,13 +701,25 @@ class Peak(Observable):
 
     def clear_params(self):
         """Clear this peaks' parameters from the model."""
-        pars_to_del = [
-            par for par in self.params
-            if re.match(r"{}_[a-z]+".format(self.name), par)
-        ]
+        prefix = "{}_".format(self.name)
+        pars_to_del = [par for par in self.params if par.startswith(prefix)]
         for par in pars_to_del:
             self.params.pop(par)
 
+    def __getstate__(self):
+        """Leave the cached intensity out of pickled project files and
+        copies.
+        """
+        state = self.__dict__.copy()
+        state["_cache"] = (None, None)
+        return state
+
+    def emit(self, signal, **kwargs):
+        """Drop the cached intensity before notifying observers."""
+        if signal == "changed-peak":
+            self._cache = (None, None)
+        super().emit(signal, **kwargs)
+
     @property
     def model(self):
         """Returns model."""
@@ -566,19 +740,45 @@ class Peak(Observable):
 
     @property
     def intensity(self):
-        """Intensity array over whole energy range of parent spectrum."""
-        with IgnoreUnderflow():
-            intensity = self._model.eval(
-                params=self.params,
-                x=self.spectrum.energy
-            )
+        """Intensity array over whole energy range of parent spectrum.
+        The result is cached as long as neither the parameters nor the
+        energy array change, so treat it as read-only.
+        """
+        energy = self.spectrum.energy
+        key = tuple(
+            self.params[name].value for name in self._model.param_names
+        ) + (id(energy), energy.shape[0])
+        cached_key, cached = self._cache
+        if key == cached_key and cached[0] is energy:
+            return cached[1]
+        intensity = self.intensity_of_E(energy)
+        self._cache = (key, (energy, intensity))
         return intensity
 
     def intensity_of_E(self, energy):
         """Returns model intensity at given energy."""
         with IgnoreUnderflow():
-            intensity = self._model.eval(params=self.params, x=energy)
-        return intensity
+            if self._name_params is None:
+                return self._model.eval(params=self.params, x=energy)
+            values = [
+                float(self.params[name].value) for name in self._name_params
+            ]
+            x = np.asarray(energy, dtype=float)
+            intensity = _kernels.pseudovoigt(x.reshape(-1), *values)
+        return intensity.reshape(x.shape)
+
+    def accumulate_intensity(self, energy, out):
+        """Adds the model intensity at the energies in the one-dimensional
+        array energy to the array out in place.
+        """
+        if self._name_params is None:
+            out += self.intensity_of_E(energy)
+            return
+        values = [
+            float(self.params[name].value) for name in self._name_params
+        ]
+        with IgnoreUnderflow():
+            _kernels.pseudovoigt_accumulate(energy, *values, out)
 
     def set_constraints(
             self, param_alias,
@@ -596,7 +796,9 @@ class Peak(Observable):
         try:
             param = self.get_param(param_alias)
         except ValueError:
-            LOG.debug(f"Skipped parameter {param_alias} (model {self.model})")
+            LOG.debug(
+                "Skipped parameter %s (model %s)", param_alias, self.model
+            )
             return
 
         new = {
@@ -616,14 +818,14 @@ class Peak(Observable):
             expr = self.relation2expr(expr, param_alias)
             try:
                 param.set(expr=expr, min=0, max=np.inf)
-                self.params.valuesdict()
+                param.value  # pylint: disable=pointless-statement
             except (SyntaxError, NameError, TypeError):
                 old["expr"] = ""
                 param.set(**old)
                 self.emit("changed-peak")
-                LOG.warning("Invalid expression '{}'".format(expr))
+                LOG.warning("Invalid expression '%s'", expr)
 
-        LOG.info("Fit parameter set: '{}'".format(param))
+        LOG.info("Fit parameter set: '%s'", param)
         self.emit("changed-peak")
 
     def get_constraints(self, param_alias):
@@ -648,20 +850,21 @@ class Peak(Observable):
     def expr2relation(self, expr):
         """Translates technical expr string into a human-readable relation.
         """
+        in_spectrum = self in self.spectrum.peaks
         def param_repl(matchobj):
             """Replaces 'peakname_param' by 'peakname'"""
             param_key = matchobj.group(0)
             name = param_key.split("_")[0]
-            if self in self.spectrum.peaks:
+            if in_spectrum:
                 return name
             return param_key
-        regex = r"\b[A-Za-z][A-Za-z0-9]*_[a-z_]+"
-        relation = re.sub(regex, param_repl, expr)
+        relation = NAME_PARAM_RE.sub(param_repl, expr)
         return relation
 
     def relation2expr(self, relation, param_alias):
         """Translates a human-readable arithmetic relation to an expr string.
         """
+        peaks = {peak.name.upper(): peak for peak in self.spectrum.peaks}
         def name_repl(matchobj):
             """Replaces 'peakname' by 'peakname_param' (searches
             case-insensitive).
@@ -670,14 +873,12 @@ class Peak(Observable):
             name = name.upper()
             if name == self.name.upper():
                 raise ValueError("Self-reference in peak constraint")
-            for peak in self.spectrum.peaks:
-                if peak.name.upper() == name:
-                    other = peak
-                    param_name = other.param_aliases[param_alias]
-                    return "{}_{}".format(name, param_name)
+            other = peaks.get(name)
+            if other is not None:
+                param_name = other.param_aliases[param_alias]
+                return "{}_{}".format(other.name, param_name)
             return name
-        regex = r"\b[A-Za-z][A-Za-z0-9]*"
-        expr = re.sub(regex, name_repl, relation)
+        expr = NAME_RE.sub(name_repl, relation)
         return expr
 
     @property
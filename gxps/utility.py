@@ -1,5 +1,4 @@
 """Provides utility classes for Observer pattern and Singleton pattern."""
-# pylint: disable=logging-format-interpolation
 
 import logging
 import copy
@@ -29,14 +28,15 @@ class MetaDataContainer:
         """
         if not silent:
             self._get_meta(attr)
-        if attr not in self._meta:
+        try:
+            return self._meta[attr]
+        except KeyError:
             if self._default_meta_value == "RAISE":
                 raise AttributeError(
                     "No meta-attribute '{}' exists in {}"
                     "".format(attr, self)
-                )
+                ) from None
             return self._default_meta_value
-        return self._meta[attr]
 
     def _set_meta(self, attr, value):
         """Hook being invoked on every self.set_meta call."""
@@ -132,35 +132,28 @@ class EventBus:
             self._subscribers[signal] = []
         self._subscribers[signal].append((callback, priority))
         LOG.debug(
-            "{} subscribed to signal '{}' on {}"
-            "".format(callback, signal, self)
+            "%s subscribed to signal '%s' on %s", callback, signal, self
         )
 
     def unsubscribe(self, callback, signal="all"):
         """Disconnects a callback from the queue, by default for all signals.
         """
         if signal == "all":
-            for sub_list in self._subscribers:
-                dict(sub_list).pop(callback, None)
-                # if callback in sub_list:
-                #     sub_list.remove(callback)
-            LOG.debug(
-                "{} unsubscribed from all signals on {}"
-                "".format(callback, self)
-            )
+            for sub_list in self._subscribers.values():
+                sub_list[:] = [sub for sub in sub_list if sub[0] != callback]
+            LOG.debug("%s unsubscribed from all signals on %s", callback, self)
         else:
-            dict(self._subscribers[signal]).pop(callback, None)
-            # if callback in self._subscribers[signal]:
-            #     self._subscribers[signal].remove(callback)
+            sub_list = self._subscribers.get(signal, [])
+            sub_list[:] = [sub for sub in sub_list if sub[0] != callback]
             LOG.debug(
-                "{} unsubscribed from signal '{}' on {}"
-                "".format(callback, signal, self)
+                "%s unsubscribed from signal '%s' on %s",
+                callback, signal, self
             )
 
     def enqueue(self, event):
         """Enqueues event.
         """
-        LOG.debug("Enqueue signal '{}' to {}".format(event.signal, self))
+        LOG.debug("Enqueue signal '%s' to %s", event.signal, self)
         policy = self._policy.get(event.signal, self._policy["default"])
         if self._policy["all"]:
             policy = self._policy["all"]
@@ -193,11 +186,11 @@ class EventBus:
                     cbs.append((prio, callback, event_list))
             if not cbs:
                 return
-            LOG.debug(f"Firing signals {_signals}")
+            LOG.debug("Firing signals %s", _signals)
             for prio, callback, event_list in sorted(cbs, key=lambda x: -x[0]):
                 LOG.debug(
-                    f"Signal '{event_list.signal}' calls {callback}"
-                    f"with prio {prio}"
+                    "Signal '%s' calls %s with prio %s",
+                    event_list.signal, callback, prio
                 )
                 callback(event_list)
             if self._queue:
@@ -207,7 +200,7 @@ class EventBus:
                 return
             if signal not in self._subscribers:
                 return
-            LOG.debug("Fire signal '{}' on {}".format(signal, self))
+            LOG.debug("Fire signal '%s' on %s", signal, self)
             event_list = EventList(self._queue[signal])
             self._queue[signal].clear()
             subs = self._subscribers[signal]
@@ -223,8 +216,7 @@ class EventBus:
             raise ValueError("Unknown Event Queue policy")
         self._policy[signal] = policy
         LOG.debug(
-            "Set policy to '{}' (signal '{}') on {}"
-            "".format(policy, signal, self)
+            "Set policy to '%s' (signal '%s') on %s", policy, signal, self
         )
 
     def get_policy(self, signal="all"):
@@ -294,7 +286,7 @@ class Observable:
         """Registers a queue where events are sent to.
         """
         self._queues.append(queue)
-        LOG.debug("{} registered to queue {}".format(self, queue))
+        LOG.debug("%s registered to queue %s", self, queue)
 
     def register_children_to_queue(self, queue):
         """Registers the children with the given queue.
@@ -307,13 +299,13 @@ class Observable:
         """Unregisters a queue.
         """
         self._queues.remove(queue)
-        LOG.debug("{} unregistered from queue {}".format(self, queue))
+        LOG.debug("%s unregistered from queue %s", self, queue)
 
     def unregister_all_queues(self):
         """Unregisters all queues.
         """
         self._queues.clear()
-        LOG.debug("{} unregistered all from queues".format(self))
+        LOG.debug("%s unregistered all from queues", self)
 
     def emit(self, signal, **kwargs):
         """Emit a signal: call all corresponding observers with an event
@@ -321,10 +313,11 @@ class Observable:
         """
         if signal not in self._signals:
             raise ValueError("{} cannot emit signal '{}'".format(self, signal))
+        if not self._queues:
+            return
         event = Event(signal)
         event.source.append(self)
-        for key, value in kwargs.items():
-            event.properties[key] = value
+        event.properties.update(kwargs)
 
         for queue in self._queues:
             queue.enqueue(event)
@@ -90,3 +90,13 @@ def test_calculate_normalization_divisor(spectrum):
     assert np.isclose(divisor, 4)
     divisor = proc.calculate_normalization_divisor("none", d, e, i)
     assert np.isclose(divisor, 1.0)
+
+def test_make_equidistant_duplicate_energy():
+    energy = np.array([1.0, 2.0, 2.0, 3.0, 4.0])
+    intensity = np.array([4.0, 5.0, 5.0, 6.0, 7.0])
+    e, i = proc.make_equidistant(energy, intensity)
+    assert len(e) == len(i) == len(energy)
+    energy = np.array([1.0, 1.5, 2.0, 3.0, 3.0, 4.0])
+    e, i = proc.make_equidistant(energy, np.arange(6.0))
+    assert len(e) == len(i)
+    assert proc.is_equidistant(e)
@@ -4,11 +4,16 @@
 # pylint: disable=redefined-outer-name
 # pylint: disable=protected-access
 
+import copy
+import pickle
+
 import pytest
 import numpy as np
 import matplotlib.pyplot as plt
 
-from gxps.spectrum import Spectrum, SpectrumContainer
+from gxps.spectrum import Spectrum, ModeledSpectrum, SpectrumContainer
+from gxps.utility import EventBus
+from gxps.models import gl_sum
 from gxps import io
 
 
@@ -38,6 +43,26 @@ def simple_spectrum():
         key="T 2"
     )
 
+@pytest.fixture
+def quadratic_spectrum():
+    return Spectrum(
+        energy=range(20),
+        intensity=np.arange(20) ** 2,
+        filename="fixture_nofile",
+        name="fixture",
+        notes=""
+    )
+
+@pytest.fixture
+def quadratic_modeled_spectrum():
+    return ModeledSpectrum(
+        energy=range(20),
+        intensity=np.arange(20) ** 2,
+        filename="fixture_nofile",
+        name="fixture",
+        notes=""
+    )
+
 parsed_spectra.append(Spectrum(
     energy=[1, 2, 3],
     intensity=[4, 5, 6],
@@ -46,6 +71,27 @@ parsed_spectra.append(Spectrum(
     key="T 1"
 ))
 
+def pv_spectrum():
+    """Three noisy PseudoVoigt peaks with slightly off start values."""
+    energy = np.linspace(500, 540, 2001)
+    intensity = (
+        gl_sum(energy, amplitude=300, center=520, fwhm=1.5, fraction=0.3)
+        + gl_sum(energy, amplitude=200, center=523, fwhm=2.0, fraction=0.6)
+        + gl_sum(energy, amplitude=100, center=515, fwhm=1.0, fraction=0.1)
+        + np.random.RandomState(0).normal(0, 0.5, energy.size)
+    )
+    spectrum = ModeledSpectrum(
+        energy=energy,
+        intensity=intensity,
+        filename="fixture_nofile",
+        name="fixture",
+        notes=""
+    )
+    spectrum.add_peak("A", area=250, fwhm=1.2, position=519.5)
+    spectrum.add_peak("B", area=150, fwhm=2.5, position=523.5)
+    spectrum.add_peak("C", area=80, fwhm=1.3, position=515.3)
+    return spectrum
+
 
 ########## Test functions
 
@@ -270,3 +316,135 @@ def test_fitting(tio2f):
     p1.alpha = 1.5
     tio2f.model.fit(tio2f.energy, tio2f.intensity - tio2f.background)
     assert p1.alpha == 1.0
+
+def test_cached_intensity_follows_params(quadratic_modeled_spectrum):
+    spectrum = quadratic_modeled_spectrum
+    peak = spectrum.add_peak("p1", area=50, fwhm=2, position=8)
+    intensity = peak.intensity.copy()
+    fit = spectrum.fit.copy()
+    spectrum.params["p1_fwhm"].value = 4
+    assert not np.allclose(peak.intensity, intensity)
+    assert not np.allclose(spectrum.fit, fit)
+    assert np.allclose(peak.intensity, peak.intensity_of_E(spectrum.energy))
+    assert np.allclose(spectrum.fit, peak.intensity)
+
+def test_cached_intensity_follows_calibration(quadratic_modeled_spectrum):
+    spectrum = quadratic_modeled_spectrum
+    peak = spectrum.add_peak("p1", area=50, fwhm=2, position=8)
+    intensity = peak.intensity.copy()
+    fit = spectrum.fit.copy()
+    spectrum.energy_calibration = 3
+    assert not np.allclose(peak.intensity, intensity)
+    assert not np.allclose(spectrum.fit, fit)
+    assert np.allclose(peak.intensity, peak.intensity_of_E(spectrum.energy))
+    assert np.allclose(spectrum.fit, peak.intensity)
+
+def test_cached_intensity_follows_shape(quadratic_modeled_spectrum):
+    spectrum = quadratic_modeled_spectrum
+    peak = spectrum.add_peak("p1", area=50, fwhm=2, position=8)
+    intensity = peak.intensity.copy()
+    fit = spectrum.fit.copy()
+    peak.shape = "DoniachSunjic"
+    assert not np.allclose(peak.intensity, intensity)
+    assert not np.allclose(spectrum.fit, fit)
+    assert np.allclose(peak.intensity, peak.intensity_of_E(spectrum.energy))
+    assert np.allclose(spectrum.fit, peak.intensity)
+
+def test_cached_intensity_follows_reference(quadratic_modeled_spectrum):
+    spectrum = quadratic_modeled_spectrum
+    p1 = spectrum.add_peak("p1", area=50, fwhm=2, position=8)
+    p2 = spectrum.add_peak("p2", area=50, fwhm=2, position=12)
+    p2.set_constraints("fwhm", expr="p1 * 2")
+    intensity = p2.intensity.copy()
+    fit = spectrum.fit.copy()
+    spectrum.params["p1_fwhm"].value = 1
+    assert not np.allclose(p2.intensity, intensity)
+    assert not np.allclose(spectrum.fit, fit)
+    assert np.allclose(p2.intensity, p2.intensity_of_E(spectrum.energy))
+    assert np.allclose(spectrum.fit, p1.intensity + p2.intensity)
+
+def test_cached_intensity_not_copied(quadratic_modeled_spectrum):
+    spectrum = quadratic_modeled_spectrum
+    spectrum.add_peak("p1", area=50, fwhm=2, position=8)
+    fit = spectrum.fit.copy()
+    for clone in (
+            copy.deepcopy(spectrum),
+            pickle.loads(pickle.dumps(spectrum))
+        ):
+        assert clone._fit_cache == (None, None)
+        assert clone.peaks[0]._cache == (None, None)
+        assert np.allclose(clone.fit, fit)
+
+def test_remove_background_bounds_shared_bound(quadratic_spectrum):
+    spectrum = quadratic_spectrum
+    spectrum.background_bounds = [2, 8, 8, 14]
+    spectrum.remove_background_bounds(8, 2)
+    assert np.allclose(spectrum.background_bounds, [8, 14])
+    with pytest.raises(ValueError):
+        spectrum.remove_background_bounds(2, 8)
+    assert np.allclose(spectrum.background_bounds, [8, 14])
+
+def test_batch_background_emits_once(quadratic_spectrum):
+    events = []
+    bus = EventBus("fire")
+    bus.subscribe(events.append, "changed-spectrum")
+    spectrum = quadratic_spectrum
+    spectrum.register_queue(bus)
+    with spectrum.batch_background():
+        spectrum.background_type = "linear"
+        with spectrum.batch_background():
+            spectrum.add_background_bounds(2, 6)
+            spectrum.add_background_bounds(10, 14)
+        assert not events
+        assert not spectrum.background.any()
+    assert len(events) == 1
+    assert np.allclose(spectrum.background[2:6], np.linspace(4, 25, 4))
+
+def test_batch_background_recalculates_on_error(quadratic_spectrum):
+    spectrum = quadratic_spectrum
+    with pytest.raises(RuntimeError):
+        with spectrum.batch_background():
+            spectrum.background_type = "linear"
+            spectrum.background_bounds = [2, 6]
+            raise RuntimeError
+    assert np.allclose(spectrum.background[2:6], np.linspace(4, 25, 4))
+
+def test_relation_with_lowercase_peak_name(quadratic_modeled_spectrum):
+    spectrum = quadratic_modeled_spectrum
+    p1 = spectrum.add_peak("p1", area=1, fwhm=1, position=3)
+    spectrum.add_peak("p2", area=1, fwhm=2, position=6)
+    assert p1.relation2expr("p2 * 2", "fwhm") == "p2_fwhm * 2"
+    p1.set_constraints("fwhm", expr="p2 * 2")
+    assert spectrum.params["p1_fwhm"].expr == "p2_fwhm * 2"
+    assert np.isclose(spectrum.params["p1_fwhm"].value, 4)
+
+def test_fast_fit_matches_lmfit():
+    spectrum = pv_spectrum()
+    reference = pv_spectrum()
+    data = spectrum.intensity - spectrum.background
+    assert spectrum._fit_fast(spectrum.energy, data)
+    result = reference.model.fit(data, reference.params, x=reference.energy)
+    for name in spectrum.params:
+        assert np.isclose(
+            spectrum.params[name].value,
+            result.params[name].value,
+            rtol=1e-3,
+            atol=1e-3
+        )
+    assert np.isclose(
+        np.sum((spectrum.fit - data) ** 2),
+        np.sum(result.residual ** 2),
+        rtol=1e-3
+    )
+
+def test_fast_fit_falls_back_with_expr():
+    spectrum = pv_spectrum()
+    spectrum.peaks[1].set_constraints("fwhm", expr="a * 2")
+    data = spectrum.intensity - spectrum.background
+    assert not spectrum._fit_fast(spectrum.energy, data)
+    spectrum.do_fit()
+    assert np.isclose(
+        spectrum.params["B_fwhm"].value,
+        2 * spectrum.params["A_fwhm"].value
+    )
+    assert np.isclose(spectrum.params["A_center"].value, 520, atol=0.1)
@@ -2,8 +2,34 @@
 # pylint: disable=invalid-name
 # pylint: disable=missing-docstring
 
-from gxps.utility import Observable
+from gxps.utility import EventBus, Observable
 
 
 def test_observable():
     o = Observable
+
+def test_eventbus_unsubscribe():
+    class Emitter(Observable):
+        _signals = ("changed-a", "changed-b")
+    calls = []
+    def cb_one(event):
+        calls.append(("one", event.signal))
+    def cb_two(event):
+        calls.append(("two", event.signal))
+
+    bus = EventBus("fire")
+    bus.subscribe(cb_one, "changed-a")
+    bus.subscribe(cb_two, "changed-a")
+    bus.subscribe(cb_one, "changed-b")
+    emitter = Emitter()
+    emitter.register_queue(bus)
+
+    bus.unsubscribe(cb_one, "changed-a")
+    emitter.emit("changed-a")
+    emitter.emit("changed-b")
+    assert calls == [("two", "changed-a"), ("one", "changed-b")]
+    calls.clear()
+    bus.unsubscribe(cb_one)
+    emitter.emit("changed-a")
+    emitter.emit("changed-b")
+    assert calls == [("two", "changed-a")]